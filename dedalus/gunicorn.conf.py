@@ -0,0 +1,11 @@
+import multiprocessing
+
+# Quart is ASGI, so gunicorn only manages the worker processes; each
+# worker runs the app on its own uvicorn event loop.
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = multiprocessing.cpu_count()
+
+# Import the app once in the master so module-level state (prompt
+# constants, the httpx client config, caches) is shared copy-on-write
+# across workers instead of duplicated per process.
+preload_app = True
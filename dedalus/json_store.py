@@ -0,0 +1,86 @@
+import logging
+import os
+import tempfile
+import aiofiles
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# In-memory cache of parsed JSON files keyed by path: (mtime_ns, data).
+# During a multi-step flow dedalus.json is read and written many times;
+# caching on mtime means we only reparse when the file actually changed.
+_cache: dict[str, tuple[int, dict]] = {}
+
+
+def load_json(filename: str) -> dict:
+    """
+    Loads and caches a JSON file. The parsed dict is reused until the
+    file's mtime changes on disk.
+    """
+    mtime = os.stat(filename).st_mtime_ns
+    cached = _cache.get(filename)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(filename, "rb") as file:
+        data = orjson.loads(file.read())
+    _cache[filename] = (mtime, data)
+    return data
+
+
+def save_json(filename: str, data: dict):
+    """
+    Atomically writes a JSON file and refreshes the cache entry so the
+    next read doesn't reparse what was just written. Each writer gets its
+    own uniquely named temp file in the target directory (a shared name
+    would let concurrent writers truncate each other mid-replace), so a
+    crash or racing save can never leave a half-written (corrupt) file
+    behind.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+        os.replace(tmp, filename)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    _cache[filename] = (os.stat(filename).st_mtime_ns, data)
+    logger.debug("Saved %s and refreshed cache", filename)
+
+
+async def load_json_async(filename: str) -> dict:
+    """
+    Async variant of load_json using aiofiles; same mtime-keyed cache.
+    """
+    mtime = os.stat(filename).st_mtime_ns
+    cached = _cache.get(filename)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    async with aiofiles.open(filename, "rb") as file:
+        data = orjson.loads(await file.read())
+    _cache[filename] = (mtime, data)
+    return data
+
+
+async def save_json_async(filename: str, data: dict):
+    """
+    Async variant of save_json using aiofiles; same atomic
+    unique-temp-then-replace dance, same cache refresh.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename) or ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        async with aiofiles.open(tmp, "wb") as file:
+            await file.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+        os.replace(tmp, filename)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    _cache[filename] = (os.stat(filename).st_mtime_ns, data)
+    logger.debug("Saved %s and refreshed cache", filename)
@@ -1,54 +1,43 @@
 import logging
 from dotenv import load_dotenv
 from dedalus_labs import AsyncDedalus, DedalusRunner
+from dedalus_labs.utils.streaming import stream_async
+from json_store import load_json_async, save_json_async
 import json
+import orjson
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,  # INFO, DEBUG, WARNING, ERROR
-    format='%(asctime)s - %(levelname)s - %(message)s',  # include timestamp
-    datefmt='%Y-%m-%d %H:%M:%S',
-    force=True
-)
+logger = logging.getLogger(__name__)
 
 # Load environment variables from a .env file
 load_dotenv()
 
-def write_instructions(filename:str, instructions:str):
+# Shared client/runner: reuse the Dedalus connection across calls instead of
+# paying a fresh TCP/TLS handshake on every request
+_client = AsyncDedalus()
+_runner = DedalusRunner(_client)
+
+async def write_instructions(filename:str, instructions:str):
     """
     Writes the generated instructions to a JSON file.
+    Uses aiofiles so the event loop isn't blocked during disk I/O.
     """
     try:
-        with open(filename, "r") as file:
-            data = json.load(file)
+        data = await load_json_async(filename)
     except (FileNotFoundError, json.JSONDecodeError):
         # If file doesn't exist or is empty/invalid, create new structure
-        logging.warning("File %s not found or invalid, creating new", filename)
+        logger.warning("File %s not found or invalid, creating new", filename)
         data = {"message": "", "instructions": []}
 
     data.setdefault("instructions", [])
     data["instructions"].append(instructions)
-    with open(filename, "w") as file:
-        json.dump(data, file, indent=4)
-    logging.info("Wrote instructions to %s", filename)
+    await save_json_async(filename, data)
+    logger.debug("Wrote instructions to %s", filename)
     return
 
-async def make_instructions(prompt: str, context: list) -> str:
-    client = AsyncDedalus()
-    runner = DedalusRunner(client)
-
-    str_context = ", ".join(map(lambda x: json.dumps(x, ensure_ascii=False, indent=4), context))
-
-    logging.info("Starting instruction generation process.")
-
-    result = await runner.run(
-        input=f"""You are helping an elderly person navigate websites. They need SIMPLE, step-by-step instructions.
-
-USER'S REQUEST:
-{prompt}
-
-CURRENT WEBPAGE ELEMENTS:
-{str_context}
+# Static prompt text built once at import. The variable parts (request,
+# page elements) are joined in at send time, and the big static block comes
+# first so providers with prompt caching can reuse the shared prefix.
+_PROMPT_STATIC = """You are helping an elderly person navigate websites. They need SIMPLE, step-by-step instructions.
 
 YOUR TASK:
 Create clear, numbered instructions to help them complete their request on THIS EXACT webpage they're currently on.
@@ -71,7 +60,29 @@ EXAMPLE (good):
 4. Type your password.
 5. Click the blue button that says "Log In".
 
-NOW RESPOND WITH NUMBERED STEPS ONLY:""",
+USER'S REQUEST:
+"""
+
+_PROMPT_ELEMENTS = "\n\nCURRENT WEBPAGE ELEMENTS:\n"
+
+_PROMPT_SUFFIX = "\n\nNOW RESPOND WITH NUMBERED STEPS ONLY:"
+
+
+def _build_prompt(prompt: str, context: list) -> str:
+    """
+    Builds the full instruction-generation prompt from the user's request
+    and the annotated page elements.
+    """
+    str_context = ", ".join(map(lambda x: orjson.dumps(x, option=orjson.OPT_INDENT_2).decode(), context))
+
+    return "".join([_PROMPT_STATIC, prompt, _PROMPT_ELEMENTS, str_context, _PROMPT_SUFFIX])
+
+
+async def make_instructions(prompt: str, context: list) -> str:
+    logger.debug("Starting instruction generation process.")
+
+    result = await _runner.run(
+        input=_build_prompt(prompt, context),
         model=[
             "anthropic/claude-sonnet-4-20250514",  # Best for precise instruction-following
             ],
@@ -82,9 +93,40 @@ NOW RESPOND WITH NUMBERED STEPS ONLY:""",
         max_steps=5,
         )
     
-    logging.info("Instruction generation process completed.")
+    logger.debug("Instruction generation process completed.")
 
     # Optionally writes full instructions to file for record-keeping
-    write_instructions("dedalus.json", result.final_output)
+    await write_instructions("dedalus.json", result.final_output)
+
+    return result.final_output
+
+
+async def stream_instructions(prompt: str, context: list):
+    """
+    Streaming variant of make_instructions: yields output tokens as the
+    model produces them instead of blocking for the full agent run.
+    The complete output is still written to dedalus.json at the end.
+    """
+    logger.debug("Starting streaming instruction generation.")
+
+    chunks = []
+    async for chunk in stream_async(_runner.run(
+        input=_build_prompt(prompt, context),
+        model=[
+            "anthropic/claude-sonnet-4-20250514",
+            ],
+        mcp_servers= [
+            "windsor/brave-search-mcp"
+        ],
+        stream=True,
+        max_steps=5,
+        )):
+        token = chunk if isinstance(chunk, str) else getattr(chunk, "delta", "") or ""
+        if not token:
+            continue
+        chunks.append(token)
+        yield token
+
+    logger.debug("Streaming instruction generation completed.")
 
-    return result.final_output
\ No newline at end of file
+    await write_instructions("dedalus.json", "".join(chunks))
\ No newline at end of file
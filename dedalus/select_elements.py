@@ -1,29 +1,244 @@
+import asyncio
+import hashlib
 import logging
+import os
+import re
+import time
+from collections import OrderedDict
 from dotenv import load_dotenv
 from dedalus_labs import AsyncDedalus, DedalusRunner
+from json_store import load_json, save_json
 import json
+import orjson
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S',
-    force=True
-)
+logger = logging.getLogger(__name__)
 
 # Load environment variables
 load_dotenv()
 
+# Shared client/runner: reuse the Dedalus connection across calls instead of
+# paying a fresh TCP/TLS handshake on every request
+_client = AsyncDedalus()
+_runner = DedalusRunner(_client)
+
+
+# Tags the user can actually interact with; everything else is noise for
+# the matching prompt
+_INTERACTIVE_TAGS = {"button", "a", "input", "textarea", "select"}
+
+# Shared matching guidance used by both selection prompts
+_MATCHING_RULES = """MATCHING RULES:
+1. **Action Words**:
+   - "click/tap/press" → look for buttons, links
+   - "type/enter/input" → look for input fields, textareas
+   - "select/choose" → look for select dropdowns, buttons
+
+2. **Fuzzy Matching** (these are equivalent):
+   - "Log in" = "Login" = "Sign in" = "Sign In" = "log in"
+   - "Email" = "email address" = "E-mail"
+   - "Password" = "pass" = "pwd"
+   - "Search" = "Find" = magnifying glass icon
+
+3. **Prioritize by Type**:
+   - For "click the X button" → prefer tag="button" over tag="a"
+   - For "type in X" → prefer tag="input" or textarea
+   - Look at element's "type" and "role" fields for hints
+
+4. **Informational Steps** (use null for these):
+   - "Wait for..."
+   - "You will see..."
+   - "Remember to..."
+   - Steps with NO specific element to click/type"""
+
+# Static text of the per-step selection prompt, built once at import. The
+# variable parts (step, elements) are joined in at send time, static block
+# first so providers with prompt caching can reuse the shared prefix.
+_SELECT_PROMPT_STATIC = f"""You are an expert at matching user instructions to webpage elements for elderly users.
+
+YOUR TASK:
+Identify which element (if any) the user should interact with for the instruction step given below.
+
+{_MATCHING_RULES}
+
+EXAMPLES:
+Step: "Click the Log In button"
+Elements: [{{"id": "ai-1", "tag": "button", "text": "Sign in"}}, {{"id": "ai-2", "tag": "a", "text": "Register"}}]
+→ Answer: {{"id": "ai-1", "tag": "button", "text": "Sign in"}}
+(matched because "Log In" ≈ "Sign in" and it's a button)
+
+Step: "Type your email address in the email box"
+Elements: [{{"id": "ai-3", "tag": "input", "text": "Email or phone number", "type": "text"}}, {{"id": "ai-4", "tag": "button", "text": "Submit"}}]
+→ Answer: {{"id": "ai-3", "tag": "input", "text": "Email or phone number", "type": "text"}}
+(matched because it's an input field for email)
+
+Step: "Wait for the page to load"
+→ Answer: null
+(informational, no interaction needed)
+
+OUTPUT FORMAT:
+- Return ONLY the JSON object of the matching element
+- OR return: null
+- NO explanations, NO extra text
+
+INSTRUCTION STEP:
+"""
+
+# Same idea for the batched prompt; the output-format tail is dynamic
+# because it pins the expected array length
+_BATCH_PROMPT_STATIC = f"""You are an expert at matching user instructions to webpage elements for elderly users.
+
+YOUR TASK:
+For EACH instruction step given below, identify which element (if any) the user should interact with.
+
+{_MATCHING_RULES}
+
+INSTRUCTION STEPS:
+"""
+
+_PROMPT_ELEMENTS = "\n\nAVAILABLE ELEMENTS:\n"
+
+# Steps that describe something to observe rather than an element to use.
+# Catching these up front saves an LLM call whose answer is always null —
+# typically 1-2 steps out of a 6-step instruction set
+_NOOP_STEP_RE = re.compile(
+    r'^\s*\d+\.\s*(wait|you (will|should) see|remember|note:|make sure|once the page)',
+    re.IGNORECASE,
+)
+
+# Matches one numbered step ("3. Click the button"), including continuation
+# lines, up to the next step number or the end of the string
+_STEP_RE = re.compile(r'^\s*(\d+)\.\s+(.*?)(?=\n\s*\d+\.|\Z)', re.DOTALL | re.MULTILINE)
+
+# Markdown code fences the model sometimes wraps its JSON in
+_FENCE_RE = re.compile(r'^```(?:json)?\s*|\s*```$')
+
+# First JSON-looking object or array inside a prose response
+_JSON_BLOB_RE = re.compile(r'\{.*\}|\[.*\]', re.DOTALL)
+
+
+def _extract_json(response: str):
+    """
+    Parses an LLM response that should be JSON but may arrive wrapped in
+    markdown fences or surrounded by prose. Fast path is a plain
+    orjson.loads; the fallback pulls the first JSON-looking blob out with
+    a regex, so trivial formatting noise doesn't waste the whole LLM call.
+
+    Raises json.JSONDecodeError if nothing parseable is found.
+    """
+    cleaned = response.strip()
+    if cleaned.startswith("```"):
+        cleaned = _FENCE_RE.sub("", cleaned).strip()
+    try:
+        parsed = orjson.loads(cleaned)
+        logger.debug("Parsed LLM response on the fast path")
+        return parsed
+    except json.JSONDecodeError:
+        match = _JSON_BLOB_RE.search(cleaned)
+        if match is None:
+            raise
+        parsed = orjson.loads(match.group(0))
+        logger.debug("Parsed LLM response via regex fallback")
+        return parsed
+
+
+class RateLimiter:
+    """
+    Token-bucket limiter for outbound LLM calls. acquire() waits until a
+    token is available, so bursts drain at `rate` calls per second (with a
+    burst allowance of `max_tokens`) instead of slamming the provider into
+    429s whose retries would dominate latency.
+    """
+
+    def __init__(self, rate: float = 5.0, max_tokens: int = 10):
+        self._rate = rate
+        self._max_tokens = max_tokens
+        self._tokens = float(max_tokens)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self._max_tokens, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+
+
+# Shared limiter for every Dedalus call made from this module
+_rate_limiter = RateLimiter()
+
+
+# LRU of recent selection results keyed by a hash of (step, elements).
+# Re-runs over the same page (user navigates back, process_all_steps runs
+# twice, ...) skip the LLM entirely. Entries expire so a stale page that
+# happens to hash the same way isn't served forever.
+_SELECTION_CACHE: OrderedDict[bytes, tuple[float, dict | None]] = OrderedDict()
+_SELECTION_CACHE_SIZE = 512
+_SELECTION_CACHE_TTL = 300  # seconds
+
+
+def _selection_cache_key(step: str, elements_json: str) -> bytes:
+    return hashlib.blake2b(step.encode() + elements_json.encode(), digest_size=16).digest()
+
+
+def _selection_cache_get(key: bytes):
+    """Returns (True, element) on a fresh hit, (False, None) otherwise."""
+    cached = _SELECTION_CACHE.get(key)
+    if cached is None:
+        return False, None
+    if time.monotonic() - cached[0] >= _SELECTION_CACHE_TTL:
+        del _SELECTION_CACHE[key]
+        return False, None
+    _SELECTION_CACHE.move_to_end(key)
+    return True, cached[1]
+
+
+def _selection_cache_put(key: bytes, element):
+    _SELECTION_CACHE[key] = (time.monotonic(), element)
+    _SELECTION_CACHE.move_to_end(key)
+    while len(_SELECTION_CACHE) > _SELECTION_CACHE_SIZE:
+        _SELECTION_CACHE.popitem(last=False)
+
+
+def _compact_elements(annotated_html: list[dict]) -> list[dict]:
+    """
+    Reduces annotated elements to the fields the matching prompt needs,
+    keeping only interactive tags and truncating long text, so the LLM
+    context stays as small as possible.
+    """
+    compact = []
+    for element in annotated_html:
+        if str(element.get("tag", "")).lower() not in _INTERACTIVE_TAGS:
+            continue
+        slim = {key: element[key] for key in ("id", "tag", "text", "type", "role") if key in element}
+        text = slim.get("text")
+        if isinstance(text, str) and len(text) > 80:
+            slim["text"] = text[:80] + "..."
+        compact.append(slim)
+    return compact
+
+
+def serialize_elements(annotated_html: list[dict]) -> str:
+    """
+    Serializes annotated elements to the compact JSON string the selection
+    prompts embed. Callers processing several steps should call this once
+    and reuse the string rather than re-serializing per step.
+    """
+    return orjson.dumps(_compact_elements(annotated_html)).decode()
+
 
 def save_selected_element(filename: str, step_number: int, step_text: str, selected_element: dict):
     """
     Saves the selected element for a specific step to the JSON file.
     """
     try:
-        with open(filename, "r") as file:
-            data = json.load(file)
+        data = load_json(filename)
     except (FileNotFoundError, json.JSONDecodeError):
-        logging.error("Failed to read %s for saving", filename)
+        logger.error("Failed to read %s for saving", filename)
         return
     
     # Initialize selected_elements array if it doesn't exist
@@ -49,10 +264,9 @@ def save_selected_element(filename: str, step_number: int, step_text: str, selec
         data["selected_elements"].append(element_data)
     
     # Save back to file
-    with open(filename, "w") as file:
-        json.dump(data, file, indent=4)
-    
-    logging.info("Saved selected element for step %d to %s", step_number, filename)
+    save_json(filename, data)
+
+    logger.debug("Saved selected element for step %d to %s", step_number, filename)
 
 
 def get_selected_elements_history(filename: str) -> list[dict]:
@@ -60,12 +274,11 @@ def get_selected_elements_history(filename: str) -> list[dict]:
     Retrieves all saved selected elements from the JSON file.
     """
     try:
-        with open(filename, "r") as file:
-            data = json.load(file)
+        data = load_json(filename)
     except (FileNotFoundError, json.JSONDecodeError) as e:
-        logging.error("Failed to read %s: %s", filename, str(e))
+        logger.error("Failed to read %s: %s", filename, str(e))
         return []
-    
+
     return data.get("selected_elements", [])
 
 
@@ -75,18 +288,17 @@ def read_instructions(filename: str) -> str:
     Returns the most recent instruction set as a string.
     """
     try:
-        with open(filename, "r") as file:
-            data = json.load(file)
+        data = load_json(filename)
     except (FileNotFoundError, json.JSONDecodeError) as e:
-        logging.error("Failed to read %s: %s", filename, str(e))
+        logger.error("Failed to read %s: %s", filename, str(e))
         return ""
     
     if "instructions" in data and len(data["instructions"]) > 0:
         instructions = data["instructions"][-1]  # Get the most recent
-        logging.info("Read instructions from %s", filename)
+        logger.debug("Read instructions from %s", filename)
         return instructions
     else:
-        logging.error("No instructions found in %s", filename)
+        logger.error("No instructions found in %s", filename)
         return ""
 
 
@@ -96,109 +308,79 @@ def parse_steps_from_instructions(instructions: str) -> list[str]:
     Assumes steps are numbered like "1. Step one\n2. Step two"
     """
     if not instructions or not instructions.strip():
-        logging.error("EMPTY instructions received!")
+        logger.error("EMPTY instructions received!")
         return []
-    
-    lines = instructions.split('\n')
-    steps = []
-    current_step = ""
-    
-    for line in lines:
-        line = line.strip()
-        # Check if line starts with a number followed by a period (e.g., "1.", "2.")
-        if line and line[0].isdigit() and '.' in line[:4]:
-            if current_step:
-                steps.append(current_step.strip())
-            current_step = line
-        elif current_step:
-            current_step += " " + line
-    
-    if current_step:
-        steps.append(current_step.strip())
-    
+
+    # Single compiled regex instead of a per-line Python loop; continuation
+    # lines are folded into their step by the lookahead
+    steps = [
+        f"{number}. {' '.join(text.split())}"
+        for number, text in _STEP_RE.findall(instructions)
+    ]
+
     if len(steps) == 0:
-        logging.error("NO STEPS PARSED! Raw instructions: %s", instructions[:500])
+        logger.error("NO STEPS PARSED! Raw instructions: %s", instructions[:500])
     else:
-        logging.info("Parsed %d steps from instructions", len(steps))
+        logger.debug("Parsed %d steps from instructions", len(steps))
     
     return steps
 
 
-async def select_element_for_step(step: str, annotated_html: list[dict]) -> dict:
+# Parsed steps memoized by file mtime, so /select-element and
+# /select-all-elements share one read + regex parse per file change
+# instead of redoing both on every request.
+_steps_cache: dict[str, tuple[int, list[str]]] = {}
+
+
+def read_parsed_steps(filename: str) -> list[str]:
+    """
+    Returns the most recent instructions from the file, parsed into steps.
+    Re-reads and re-parses only when the file has been modified.
+    """
+    try:
+        mtime = os.stat(filename).st_mtime_ns
+    except OSError:
+        mtime = -1
+    cached = _steps_cache.get(filename)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    instructions = read_instructions(filename)
+    steps = parse_steps_from_instructions(instructions) if instructions else []
+    _steps_cache[filename] = (mtime, steps)
+    return steps
+
+
+async def select_element_for_step(step: str, elements_json: str) -> dict:
     """
     Uses Dedalus AI to identify which element from the annotated HTML
     matches the action required in the given step.
-    
+
     Args:
         step: A single instruction step (e.g., "1. Click the microphone icon to unmute")
-        annotated_html: List of interactive elements with id, tag, and text
-        
+        elements_json: Compact JSON string of interactive elements, as
+            produced by serialize_elements (serialized once by the caller)
+
     Returns:
         The element object that matches the step, or None if no interaction needed
     """
-    client = AsyncDedalus()
-    runner = DedalusRunner(client)
-    
-    logging.info("Selecting element for step: %s", step[:50])
-    
-    # Convert annotated HTML to a clean JSON string
-    elements_json = json.dumps(annotated_html, indent=2)
-    
-    prompt = f"""You are an expert at matching user instructions to webpage elements for elderly users.
-
-INSTRUCTION STEP:
-{step}
-
-AVAILABLE ELEMENTS:
-{elements_json}
-
-YOUR TASK:
-Identify which element (if any) the user should interact with for this step.
-
-MATCHING RULES:
-1. **Action Words**: 
-   - "click/tap/press" → look for buttons, links
-   - "type/enter/input" → look for input fields, textareas
-   - "select/choose" → look for select dropdowns, buttons
-   
-2. **Fuzzy Matching** (these are equivalent):
-   - "Log in" = "Login" = "Sign in" = "Sign In" = "log in"
-   - "Email" = "email address" = "E-mail"
-   - "Password" = "pass" = "pwd"
-   - "Search" = "Find" = magnifying glass icon
-   
-3. **Prioritize by Type**:
-   - For "click the X button" → prefer tag="button" over tag="a"
-   - For "type in X" → prefer tag="input" or textarea
-   - Look at element's "type" and "role" fields for hints
-   
-4. **Informational Steps** (return null for these):
-   - "Wait for..."
-   - "You will see..."
-   - "Remember to..."
-   - Steps with NO specific element to click/type
-
-EXAMPLES:
-Step: "Click the Log In button"
-Elements: [{{"id": "ai-1", "tag": "button", "text": "Sign in"}}, {{"id": "ai-2", "tag": "a", "text": "Register"}}]
-→ Answer: {{"id": "ai-1", "tag": "button", "text": "Sign in"}}
-(matched because "Log In" ≈ "Sign in" and it's a button)
+    # Informational steps have no element by definition; skip the LLM call
+    if _NOOP_STEP_RE.match(step):
+        logger.debug("Step classified as informational, skipping LLM call: %s", step[:50])
+        return None
 
-Step: "Type your email address in the email box"
-Elements: [{{"id": "ai-3", "tag": "input", "text": "Email or phone number", "type": "text"}}, {{"id": "ai-4", "tag": "button", "text": "Submit"}}]
-→ Answer: {{"id": "ai-3", "tag": "input", "text": "Email or phone number", "type": "text"}}
-(matched because it's an input field for email)
+    cache_key = _selection_cache_key(step, elements_json)
+    hit, cached_element = _selection_cache_get(cache_key)
+    if hit:
+        logger.debug("Selection cache hit for step: %s", step[:50])
+        return cached_element
 
-Step: "Wait for the page to load"
-→ Answer: null
-(informational, no interaction needed)
+    logger.debug("Selecting element for step: %s", step[:50])
 
-OUTPUT FORMAT:
-- Return ONLY the JSON object of the matching element
-- OR return: null
-- NO explanations, NO extra text"""
+    prompt = "".join([_SELECT_PROMPT_STATIC, step, _PROMPT_ELEMENTS, elements_json])
 
-    result = await runner.run(
+    await _rate_limiter.acquire()
+    result = await _runner.run(
         input=prompt,
         model=["anthropic/claude-sonnet-4-20250514"],  # Claude is more precise at element matching
         stream=False,
@@ -209,18 +391,140 @@ OUTPUT FORMAT:
     response = result.final_output.strip()
     
     if response.lower() == "null" or not response:
-        logging.info("No element interaction needed for this step")
+        logger.debug("No element interaction needed for this step")
+        _selection_cache_put(cache_key, None)
         return None
-    
+
     try:
-        # Try to parse as JSON
-        element = json.loads(response)
-        logging.info("Selected element: %s", element.get("id"))
-        return element
+        element = _extract_json(response)
     except json.JSONDecodeError:
-        logging.error("Failed to parse AI response as JSON: %s", response)
+        logger.error("Failed to parse AI response as JSON: %s", response)
+        return None
+
+    if element is None:
+        logger.debug("No element interaction needed for this step")
+        _selection_cache_put(cache_key, None)
         return None
 
+    logger.debug("Selected element: %s", element.get("id"))
+    _selection_cache_put(cache_key, element)
+    return element
+
+
+async def select_elements_for_all_steps(steps: list[str], elements_json: str) -> list:
+    """
+    Selects elements for every step in a single LLM call instead of one
+    round-trip per step, so the (large) elements context is sent once.
+
+    Args:
+        steps: All instruction steps, in order
+        elements_json: Compact JSON string from serialize_elements
+
+    Returns:
+        A list the same length as steps, where entry i is the matching
+        element dict or None.
+
+    Raises:
+        ValueError: If the response isn't a JSON array of the right length.
+    """
+    logger.debug("Selecting elements for %d steps in one batched call", len(steps))
+
+    numbered_steps = "\n".join(f"STEP {i + 1}: {step}" for i, step in enumerate(steps))
+
+    prompt = "".join([
+        _BATCH_PROMPT_STATIC,
+        numbered_steps,
+        _PROMPT_ELEMENTS,
+        elements_json,
+        f"""
+
+OUTPUT FORMAT:
+- Return ONLY a JSON array of length {len(steps)}
+- Entry i is the JSON object of the element matching STEP i+1, or null
+- NO explanations, NO extra text""",
+    ])
+
+    await _rate_limiter.acquire()
+    result = await _runner.run(
+        input=prompt,
+        model=["anthropic/claude-sonnet-4-20250514"],
+        stream=False,
+        max_steps=1,
+    )
+
+    response = result.final_output.strip()
+    elements = _extract_json(response)
+
+    if not isinstance(elements, list) or len(elements) != len(steps):
+        raise ValueError(f"Expected a JSON array of length {len(steps)}, got: {response[:200]}")
+
+    return elements
+
+
+async def stream_guided_steps(prompt: str, context: list, annotated_html: list[dict]):
+    """
+    Pipelines instruction generation with element selection: as soon as a
+    numbered step is complete in the token stream from stream_instructions,
+    its select_element_for_step call is started, instead of waiting for the
+    full instruction text first. Downstream LLM calls overlap upstream
+    generation, so the last element usually lands right after the last token.
+
+    Yields (step_text, selected_element) pairs in step order.
+    """
+    from make_instructions import stream_instructions
+
+    step_queue: asyncio.Queue = asyncio.Queue()
+
+    # Serialize the elements context once; every selection call shares it
+    elements_json = serialize_elements(annotated_html)
+
+    selection_tasks: list[asyncio.Task] = []
+
+    def _dispatch(match: re.Match):
+        step = f"{match.group(1)}. {' '.join(match.group(2).split())}"
+        task = asyncio.create_task(select_element_for_step(step, elements_json))
+        selection_tasks.append(task)
+        step_queue.put_nowait((step, task))
+
+    async def _produce():
+        buffer = ""
+        dispatched = 0
+        try:
+            async for token in stream_instructions(prompt, context):
+                buffer += token
+                matches = list(_STEP_RE.finditer(buffer))
+                # Every match except the last is terminated by the next
+                # step number, so it's definitely complete
+                while dispatched < len(matches) - 1:
+                    _dispatch(matches[dispatched])
+                    dispatched += 1
+            # Stream is over, so the trailing step is complete too
+            for match in list(_STEP_RE.finditer(buffer))[dispatched:]:
+                _dispatch(match)
+        finally:
+            # Always wake the consumer, even when the token stream dies
+            # mid-way; without this it would block on the queue forever
+            step_queue.put_nowait(None)
+
+    producer = asyncio.create_task(_produce())
+    try:
+        while True:
+            item = await step_queue.get()
+            if item is None:
+                break
+            step, task = item
+            yield step, await task
+        # Re-raises a mid-stream failure from stream_instructions so the
+        # caller reports it instead of seeing a silently truncated stream
+        await producer
+    finally:
+        # On early exit (client disconnect) stop the producer and any
+        # selection calls still in flight. cancel() doesn't suspend, so
+        # the generator closes without ignoring GeneratorExit.
+        producer.cancel()
+        for task in selection_tasks:
+            task.cancel()
+
 
 async def process_instructions_step_by_step(
     instructions_file: str, 
@@ -238,16 +542,14 @@ async def process_instructions_step_by_step(
     Returns:
         Dictionary with step info and selected element
     """
-    # Read instructions
-    instructions = read_instructions(instructions_file)
-    if not instructions:
+    # Shared mtime-memoized read + parse (in a thread so the cold-path
+    # file I/O doesn't block the loop)
+    steps = await asyncio.to_thread(read_parsed_steps, instructions_file)
+    if not steps:
         return {"error": "No instructions found"}
-    
-    # Parse into steps
-    steps = parse_steps_from_instructions(instructions)
-    
+
     if step_index >= len(steps):
-        logging.info("All steps completed!")
+        logger.debug("All steps completed!")
         return {
             "completed": True,
             "total_steps": len(steps),
@@ -256,13 +558,13 @@ async def process_instructions_step_by_step(
     
     # Get the current step
     current_step = steps[step_index]
-    logging.info("Processing step %d of %d", step_index + 1, len(steps))
+    logger.debug("Processing step %d of %d", step_index + 1, len(steps))
     
     # Select the element for this step
-    selected_element = await select_element_for_step(current_step, annotated_html)
+    selected_element = await select_element_for_step(current_step, serialize_elements(annotated_html))
     
-    # Save the selected element to file
-    save_selected_element(instructions_file, step_index + 1, current_step, selected_element)
+    # Save the selected element to file (in a thread, same reason as the read)
+    await asyncio.to_thread(save_selected_element, instructions_file, step_index + 1, current_step, selected_element)
     
     return {
         "step_number": step_index + 1,
@@ -281,32 +583,58 @@ async def process_all_steps(instructions_file: str, annotated_html: list[dict])
     Returns:
         List of dictionaries, one per step with selected element
     """
-    instructions = read_instructions(instructions_file)
-    if not instructions:
+    steps = await asyncio.to_thread(read_parsed_steps, instructions_file)
+    if not steps:
         return [{"error": "No instructions found"}]
-    
-    steps = parse_steps_from_instructions(instructions)
+
+    # Serialize the elements context once for the whole request
+    elements_json = serialize_elements(annotated_html)
+
+    # Preferred path: one batched LLM call covering every step, so the
+    # elements context is only sent (and prefilled) once.
+    try:
+        elements = await select_elements_for_all_steps(steps, elements_json)
+    except (json.JSONDecodeError, ValueError) as err:
+        logger.warning("Batched selection failed (%s), falling back to per-step calls", str(err))
+
+        # Fallback: fan the steps out concurrently. The semaphore bounds
+        # in-flight calls on top of the shared rate limiter, and 429s get
+        # a couple of exponential-backoff retries before giving up.
+        semaphore = asyncio.Semaphore(8)
+
+        async def guarded_select(step: str):
+            async with semaphore:
+                delay = 0.5
+                for attempt in range(3):
+                    try:
+                        return await select_element_for_step(step, elements_json)
+                    except Exception as err:
+                        if "429" not in str(err) or attempt == 2:
+                            return err
+                        await asyncio.sleep(delay)
+                        delay *= 2
+
+        logger.debug("Processing %d steps concurrently", len(steps))
+        async with asyncio.TaskGroup() as task_group:
+            tasks = [task_group.create_task(guarded_select(step)) for step in steps]
+        elements = [task.result() for task in tasks]
+
     results = []
-    
-    for i, step in enumerate(steps):
-        logging.info("="*50)
-        logging.info("Processing step %d/%d", i+1, len(steps))
-        
-        selected_element = await select_element_for_step(step, annotated_html)
-        
+    for i, (step, element) in enumerate(zip(steps, elements)):
+        if isinstance(element, Exception):
+            logger.error("Step %d failed: %s", i + 1, str(element))
+            element = None
         results.append({
             "step_number": i + 1,
             "step_text": step,
-            "selected_element": selected_element
+            "selected_element": element
         })
-    
+
     return results
 
 
 # Example usage
 if __name__ == "__main__":
-    import asyncio
-    
     # Example annotated HTML (simplified)
     sample_html = [
         {"id": "ai-1", "tag": "button", "text": "Mute"},
@@ -1,117 +1,265 @@
-from flask import Flask, request, jsonify
-from flask_cors import CORS
+from quart import Quart, request, Response
+from quart_cors import cors
+import gzip
+import hashlib
+import logging
 import os
-import requests
 import asyncio
+import httpx
 from dotenv import load_dotenv
-from make_instructions import make_instructions
-from select_elements import process_instructions_step_by_step, process_all_steps, get_selected_elements_history
-import json
+from make_instructions import make_instructions, stream_instructions
+from select_elements import process_instructions_step_by_step, process_all_steps, get_selected_elements_history, stream_guided_steps
+import tts_cache
+import orjson
+
+logger = logging.getLogger(__name__)
 
 # Load environment variables from parent directory
 load_dotenv(dotenv_path='../.env')
 
-app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*", "methods": ["GET", "POST", "OPTIONS"]}}, supports_credentials=False)
+# Provider credentials are constant for the process lifetime; resolve
+# them once here (after load_dotenv) and bake the auth headers, rather
+# than doing a getenv plus a header-dict build on every request.
+ELEVENLABS_API_KEY = os.environ.get("ELEVENLABS_API_KEY")
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+_ELEVENLABS_HEADERS = {'Accept': 'audio/mpeg', 'xi-api-key': ELEVENLABS_API_KEY or ''}
+_OPENAI_HEADERS = {'Authorization': f'Bearer {OPENAI_API_KEY}'}
+
+app = Quart(__name__)
+app = cors(app, allow_origin="*", allow_methods=["GET", "POST", "OPTIONS"], allow_credentials=False)
+
+
+# Single async client shared by every handler, created once at process
+# start. HTTP/2 lets concurrent TTS/transcribe calls multiplex over one
+# pooled connection per provider, and awaiting it keeps the event loop
+# free during the upstream round-trip (no more thread hand-offs).
+_http = httpx.AsyncClient(
+    http2=True,
+    timeout=30.0,
+    limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+    transport=httpx.AsyncHTTPTransport(retries=2),
+)
+
+
+# Only JSON bodies at least this large are worth a gzip pass
+_COMPRESS_MIN_SIZE = 1024
+
+
+@app.after_request
+async def _compress_response(response):
+    """
+    gzips large JSON bodies for clients that accept it.
+    /select-all-elements and the history endpoint return repetitive
+    structured JSON that compresses 5-10x. Non-JSON responses are left
+    alone: MP3 is already compressed and SSE streams have no
+    materialized body to recompress.
+    """
+    if (
+        response.mimetype != "application/json"
+        or "gzip" not in request.headers.get("Accept-Encoding", "").lower()
+        or response.headers.get("Content-Encoding")
+    ):
+        return response
+
+    body = await response.get_data()
+    if len(body) < _COMPRESS_MIN_SIZE:
+        return response
+
+    # Level 4 gets most of the ratio on JSON at a fraction of the CPU of
+    # the default level 9, and the encode runs off the event loop
+    compressed = await asyncio.to_thread(gzip.compress, body, 4)
+    await response.set_data(compressed)
+    response.headers["Content-Encoding"] = "gzip"
+    response.headers.add("Vary", "Accept-Encoding")
+    return response
+
+
+@app.after_serving
+async def _close_http():
+    # The client binds lazily to the serving loop on first use; close it
+    # on the same loop so pooled connections shut down cleanly.
+    await _http.aclose()
+
+
+def ojsonify(obj, status=200):
+    """orjson-encoded JSON response. jsonify runs the pure-Python encoder,
+    which is the serialization bottleneck for large annotated_html result
+    payloads; orjson encodes the same payloads several times faster."""
+    return Response(orjson.dumps(obj), status=status, mimetype="application/json")
+
+
+# Constant error payloads, encoded once at import. Validation branches
+# return these bytes directly via _err() — no dict build or serialization
+# on the (hot, under bad clients) rejection paths.
+_ERR_NO_JSON = orjson.dumps({"status": "error", "message": "Request body must be JSON"})
+_ERR_MISSING_MESSAGE = orjson.dumps({"status": "error", "message": "Missing 'message' field in request body"})
+_ERR_NO_ANNOTATED_HTML = orjson.dumps({"status": "error", "message": "Missing 'annotated_html' field"})
+_ERR_NO_TEXT = orjson.dumps({"status": "error", "message": "No text provided"})
+_ERR_NO_AUDIO_FILE = orjson.dumps({"status": "error", "message": "No audio file provided"})
+_ERR_NO_AUDIO_SELECTED = orjson.dumps({"status": "error", "message": "No audio file selected"})
+_ERR_NO_ELEVENLABS_KEY = orjson.dumps({"status": "error", "message": "ElevenLabs API key not configured"})
+_ERR_NO_OPENAI_KEY = orjson.dumps({"status": "error", "message": "OpenAI API key not configured"})
+
+
+def _err(payload: bytes, status: int):
+    """Response from a precompiled error payload."""
+    return Response(payload, status=status, mimetype="application/json")
+
+
+# In-flight request coalescing: identical concurrent POSTs (a double-
+# click fires two /parse calls with the same message) share one upstream
+# LLM call instead of paying for it twice. Unique traffic is unaffected.
+_inflight: dict[str, asyncio.Future] = {}
+
+
+def _flight_key(*parts) -> str:
+    return hashlib.blake2b(orjson.dumps(parts), digest_size=16).hexdigest()
+
+
+async def _singleflight(key: str, factory):
+    """
+    Runs factory() once per key; callers that arrive while it's in flight
+    await the first call's result instead of starting their own.
+    """
+    existing = _inflight.get(key)
+    if existing is not None:
+        return await asyncio.shield(existing)
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        result = await factory()
+    except BaseException as err:
+        future.set_exception(err)
+        future.exception()  # mark retrieved when nobody else was waiting
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        _inflight.pop(key, None)
+
+
+async def _get_json():
+    """Parses the request body with orjson for the same reason; returns
+    None when the body is missing or isn't valid JSON."""
+    body = await request.get_data()
+    if not body:
+        return None
+    try:
+        return orjson.loads(body)
+    except orjson.JSONDecodeError:
+        return None
 
 
 @app.post("/text-to-speech")
-def text_to_speech():
+async def text_to_speech():
     """
     Converts text to speech using ElevenLabs API
     Keeps the API key secure on the server side
     """
     try:
-        # Get API key from environment
-        api_key = os.getenv('ELEVENLABS_API_KEY')
-        if not api_key:
-            return jsonify({"status": "error", "message": "ElevenLabs API key not configured"}), 500
-        
+        if not ELEVENLABS_API_KEY:
+            return _err(_ERR_NO_ELEVENLABS_KEY, 500)
+
         # Get text from request
-        data = request.get_json()
+        data = await _get_json()
         if not data or 'text' not in data:
-            return jsonify({"status": "error", "message": "No text provided"}), 400
-        
+            return _err(_ERR_NO_TEXT, 400)
+
         text = data['text']
         voice_id = data.get('voice_id', 'EXAVITQu4vr4xnSDxMaL')  # Default to Rachel voice
-        
-        print(f"[TTS] Converting text (length: {len(text)}) with voice_id: {voice_id}")
-        
-        # Call ElevenLabs API
-        url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
-        headers = {
-            'Accept': 'audio/mpeg',
-            'Content-Type': 'application/json',
-            'xi-api-key': api_key
+        model_id = 'eleven_monolingual_v1'
+        voice_settings = {
+            'stability': 0.5,
+            'similarity_boost': 0.5
         }
-        payload = {
-            'text': text,
-            'model_id': 'eleven_monolingual_v1',
-            'voice_settings': {
-                'stability': 0.5,
-                'similarity_boost': 0.5
+
+        logger.debug("[TTS] Converting text (length: %d) with voice_id: %s", len(text), voice_id)
+
+        # Agents repeat greetings/confirmations verbatim, so check the
+        # content-addressed cache before paying ElevenLabs for the clip.
+        # Near-duplicates ("Hello!" vs "Hello.") fall through to the
+        # semantic tier; "no_cache": true skips both for exact audio.
+        no_cache = data.get('no_cache') is True
+        key = tts_cache.cache_key(text, voice_id, model_id, voice_settings)
+        audio = None if no_cache else await asyncio.to_thread(tts_cache.get, key)
+        if audio is None and not no_cache:
+            audio = await asyncio.to_thread(tts_cache.semantic_get, text, voice_id)
+
+        if audio is None:
+            # Call ElevenLabs API
+            url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
+            payload = {
+                'text': text,
+                'model_id': model_id,
+                'voice_settings': voice_settings
             }
-        }
-        
-        response = requests.post(url, json=payload, headers=headers)
-        
-        print(f"[TTS] ElevenLabs response: {response.status_code}, content length: {len(response.content)}")
-        
-        if response.status_code != 200:
-            error_msg = response.text
-            print(f"[TTS] Error from ElevenLabs: {error_msg}")
-            return jsonify({"status": "error", "message": f"Text-to-speech failed: {error_msg}"}), response.status_code
-        
-        # Return audio data as base64
-        import base64
-        audio_base64 = base64.b64encode(response.content).decode('utf-8')
-        return jsonify({"status": "success", "audio": audio_base64}), 200
-        
+
+            response = await _http.post(url, json=payload, headers=_ELEVENLABS_HEADERS)
+
+            logger.debug("[TTS] ElevenLabs response: %d, content length: %d", response.status_code, len(response.content))
+
+            if response.status_code != 200:
+                error_msg = response.text
+                logger.error("[TTS] Error from ElevenLabs: %s", error_msg)
+                return ojsonify({"status": "error", "message": f"Text-to-speech failed: {error_msg}"}, response.status_code)
+
+            audio = response.content
+            await asyncio.to_thread(tts_cache.put, key, audio)
+            await asyncio.to_thread(tts_cache.semantic_put, text, voice_id, key)
+
+        # Legacy path for clients that still want base64-in-JSON.
+        # Encoding a multi-MB clip is real CPU time, so hand it to the
+        # thread pool instead of blocking the event loop mid-request.
+        if data.get('format') == 'json':
+            import base64
+            encoded = await asyncio.to_thread(base64.b64encode, audio)
+            return ojsonify({"status": "success", "audio": encoded.decode('utf-8')}, 200)
+
+        # Default: ship the MP3 bytes directly — no base64 inflation (~33%
+        # smaller on the wire) and no full-buffer encode pass per request
+        return Response(audio, status=200, mimetype="audio/mpeg")
+
     except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 500
+        return ojsonify({"status": "error", "message": str(e)}, 500)
 
 @app.post("/transcribe")
-def transcribe_audio():
+async def transcribe_audio():
     """
     Proxies audio transcription requests to OpenAI Whisper API
     Keeps the API key secure on the server side
     """
     try:
-        # Get API key from environment
-        api_key = os.getenv('OPENAI_API_KEY')
-        if not api_key:
-            return jsonify({"status": "error", "message": "OpenAI API key not configured"}), 500
+        if not OPENAI_API_KEY:
+            return _err(_ERR_NO_OPENAI_KEY, 500)
 
         # Get audio file from request
-        if 'file' not in request.files:
-            return jsonify({"status": "error", "message": "No audio file provided"}), 400
+        files = await request.files
+        if 'file' not in files:
+            return _err(_ERR_NO_AUDIO_FILE, 400)
 
-        audio_file = request.files['file']
+        audio_file = files['file']
         if audio_file.filename == '':
-            return jsonify({"status": "error", "message": "No audio file selected"}), 400
+            return _err(_ERR_NO_AUDIO_SELECTED, 400)
 
-        # Ensure we read from the beginning of the file
-        audio_file.seek(0)
-        
         # Get content type, default to audio/webm if not provided
         content_type = audio_file.content_type or 'audio/webm'
-        
-        # Prepare form data for OpenAI API
+
+        # Multipart body built from the raw stream: httpx forwards bytes
+        # to OpenAI as they're read off the client upload instead of
+        # buffering the whole file in memory first
         files = {
-            'file': (audio_file.filename, audio_file, content_type)
+            'file': (audio_file.filename, audio_file.stream, content_type)
         }
         data = {
             'model': 'whisper-1',
             'response_format': 'json'
         }
-        headers = {
-            'Authorization': f'Bearer {api_key}'
-        }
-
-        # Forward request to OpenAI Whisper API
-        response = requests.post(
+        # Forward request to OpenAI Whisper API over the shared client
+        response = await _http.post(
             'https://api.openai.com/v1/audio/transcriptions',
-            headers=headers,
+            headers=_OPENAI_HEADERS,
             files=files,
             data=data
         )
@@ -119,58 +267,95 @@ def transcribe_audio():
         if response.status_code != 200:
             error_data = response.json() if response.headers.get('content-type', '').startswith('application/json') else {}
             error_message = error_data.get('error', {}).get('message', 'Transcription failed')
-            return jsonify({"status": "error", "message": error_message}), response.status_code
+            return ojsonify({"status": "error", "message": error_message}, response.status_code)
 
         result = response.json()
-        return jsonify({"status": "success", "text": result.get('text', '')}), 200
+        return ojsonify({"status": "success", "text": result.get('text', '')}, 200)
 
     except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 500
+        return ojsonify({"status": "error", "message": str(e)}, 500)
+
+
+async def _token_events(prompt, context):
+    """SSE frames carrying instruction tokens as the model emits them."""
+    try:
+        async for token in stream_instructions(prompt, context):
+            yield f"data: {orjson.dumps({'token': token}).decode()}\n\n"
+    except Exception as err:
+        yield f"event: error\ndata: {orjson.dumps({'message': str(err)}).decode()}\n\n"
+        return
+    yield "event: done\ndata: {}\n\n"
+
+
+async def _step_events(prompt, context):
+    """SSE frames carrying (step, element) pairs from the guided pipeline."""
+    try:
+        async for step_text, selected_element in stream_guided_steps(prompt, context, context):
+            yield f"event: step\ndata: {orjson.dumps({'step_text': step_text, 'selected_element': selected_element}).decode()}\n\n"
+    except Exception as err:
+        yield f"event: error\ndata: {orjson.dumps({'message': str(err)}).decode()}\n\n"
+        return
+    yield "event: done\ndata: {}\n\n"
 
 
 @app.post("/parse")
-def run_instructions():
+async def run_instructions():
     """
     Runs the async make_instructions() when the Chrome extension calls /parse,
     using the 'message' string sent in the request body.
+    Clients that send "stream": true (or an Accept: text/event-stream header)
+    get tokens streamed back as SSE instead of one blocking JSON response.
     Includes error handling for missing fields and unexpected exceptions.
     """
     try:
         # Parse JSON from request
-        data = request.get_json()
+        data = await _get_json()
         if not data:
-            return jsonify({"status": "error", "message": "Request body must be JSON"}), 400
+            return _err(_ERR_NO_JSON, 400)
 
         if "message" not in data:
-            return jsonify({"status": "error", "message": "Missing 'message' field in request body"}), 400
+            return _err(_ERR_MISSING_MESSAGE, 400)
 
         prompt = data["message"]
-        context = data["context"]
-        print(type(context))
+        context = data.get("context", [])
+
+        # Streaming path: send tokens as soon as the model emits them.
+        # With "guided": true, element selection is pipelined behind the
+        # token stream and each completed step is pushed as a "step" event.
+        if data.get("stream") is True or "text/event-stream" in request.headers.get("Accept", ""):
+            if data.get("guided") is True:
+                events = _step_events(prompt, context)
+            else:
+                events = _token_events(prompt, context)
+            return Response(events, mimetype="text/event-stream")
 
-        # Run the async task (creates new event loop for each request, avoiding race conditions)
+        # Await the async task directly on the server's event loop,
+        # coalescing duplicate in-flight requests onto one LLM call
         try:
-            result = asyncio.run(make_instructions(prompt, context))
+            result = await _singleflight(
+                _flight_key("parse", prompt, context),
+                lambda: make_instructions(prompt, context),
+            )
         except Exception as async_err:
-            return jsonify({
+            return ojsonify({
                 "status": "error",
                 "message": f"Make instructions function failed: {str(async_err)}"
-            }), 500
+            }, 500)
 
         # Return result
-        return jsonify({"status": "success", "result": result}), 200
+        return ojsonify({"status": "success", "result": result}, 200)
 
 
     except Exception as e:
         # Catch any other unexpected errors
-        return jsonify({"status": "error", "message": f"Unexpected server error: {str(e)}"}), 500
+        return ojsonify({"status": "error", "message": f"Unexpected server error: {str(e)}"}, 500)
 
 
 @app.post("/select-element")
-def select_element():
+async def select_element():
     """
     Selects the appropriate element from annotated HTML for a specific step.
-    
+
     Request body should contain:
     {
         "annotated_html": [...],  // Array of elements from DOMAnnotator
@@ -179,32 +364,36 @@ def select_element():
     }
     """
     try:
-        data = request.get_json()
+        data = await _get_json()
         if not data:
-            return jsonify({"status": "error", "message": "Request body must be JSON"}), 400
-        
+            return _err(_ERR_NO_JSON, 400)
+
         if "annotated_html" not in data:
-            return jsonify({"status": "error", "message": "Missing 'annotated_html' field"}), 400
-        
+            return _err(_ERR_NO_ANNOTATED_HTML, 400)
+
         annotated_html = data["annotated_html"]
         step_index = data.get("step_index", 0)
         instructions_file = data.get("instructions_file", "dedalus.json")
-        
-        # Run the async element selection (creates new event loop for each request)
-        result = asyncio.run(process_instructions_step_by_step(instructions_file, annotated_html, step_index))
-        
-        return jsonify({"status": "success", "result": result}), 200
-        
+
+        # Await the async element selection directly, deduplicating
+        # identical concurrent requests for the same step
+        result = await _singleflight(
+            _flight_key("select-element", instructions_file, step_index, annotated_html),
+            lambda: process_instructions_step_by_step(instructions_file, annotated_html, step_index),
+        )
+
+        return ojsonify({"status": "success", "result": result}, 200)
+
     except Exception as e:
-        return jsonify({"status": "error", "message": f"Unexpected error: {str(e)}"}), 500
+        return ojsonify({"status": "error", "message": f"Unexpected error: {str(e)}"}, 500)
 
 
 @app.post("/select-all-elements")
-def select_all_elements():
+async def select_all_elements():
     """
     Processes ALL steps and returns elements for each one.
     Useful for testing/previewing the full flow.
-    
+
     Request body should contain:
     {
         "annotated_html": [...],  // Array of elements from DOMAnnotator
@@ -212,50 +401,66 @@ def select_all_elements():
     }
     """
     try:
-        data = request.get_json()
+        data = await _get_json()
         if not data:
-            return jsonify({"status": "error", "message": "Request body must be JSON"}), 400
-        
+            return _err(_ERR_NO_JSON, 400)
+
         if "annotated_html" not in data:
-            return jsonify({"status": "error", "message": "Missing 'annotated_html' field"}), 400
-        
+            return _err(_ERR_NO_ANNOTATED_HTML, 400)
+
         annotated_html = data["annotated_html"]
         instructions_file = data.get("instructions_file", "dedalus.json")
-        
-        # Run the async processing for all steps (creates new event loop for each request)
-        results = asyncio.run(process_all_steps(instructions_file, annotated_html))
-        
-        return jsonify({"status": "success", "results": results}), 200
-        
+
+        # Await the async processing for all steps directly, deduplicating
+        # identical concurrent requests
+        results = await _singleflight(
+            _flight_key("select-all", instructions_file, annotated_html),
+            lambda: process_all_steps(instructions_file, annotated_html),
+        )
+
+        return ojsonify({"status": "success", "results": results}, 200)
+
     except Exception as e:
-        return jsonify({"status": "error", "message": f"Unexpected error: {str(e)}"}), 500
+        return ojsonify({"status": "error", "message": f"Unexpected error: {str(e)}"}, 500)
 
 
 @app.get("/selected-elements-history")
-def get_history():
+async def get_history():
     """
     Retrieves the history of all selected elements.
-    
+
     Query parameter:
     - instructions_file: Path to JSON file (default: dedalus.json)
-    
+
     Example: GET /selected-elements-history?instructions_file=dedalus.json
     """
     try:
         instructions_file = request.args.get("instructions_file", "dedalus.json")
-        history = get_selected_elements_history(instructions_file)
-        
-        return jsonify({
+        # Repeat GETs hit json_store's mtime-keyed parse cache; the
+        # remaining stat/read still belongs off the event loop
+        history = await asyncio.to_thread(get_selected_elements_history, instructions_file)
+
+        return ojsonify({
             "status": "success",
             "count": len(history),
             "history": history
-        }), 200
-        
+        }, 200)
+
     except Exception as e:
-        return jsonify({"status": "error", "message": f"Unexpected error: {str(e)}"}), 500
+        return ojsonify({"status": "error", "message": f"Unexpected error: {str(e)}"}, 500)
 
 
 if __name__ == "__main__":
-    import os
+    import uvicorn
+    # One logging setup for the whole process; hot-path logs are DEBUG so
+    # the default WARNING level keeps per-request formatting off in prod
+    logging.basicConfig(
+        level=os.environ.get("LOG_LEVEL", "WARNING"),
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+        force=True
+    )
     port = int(os.environ.get("PORT", 5001))
-    app.run(host="0.0.0.0", port=port, debug=False)
+    # Quart is an ASGI app, so serve it with uvicorn + uvloop; async
+    # handlers run on uvicorn's loop with no thread-bridging needed
+    uvicorn.run(app, host="0.0.0.0", port=port, loop="uvloop")
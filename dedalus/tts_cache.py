@@ -0,0 +1,155 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+import orjson
+
+# The semantic tier needs an embedder and a vector-capable sqlite; both
+# are optional — without them the exact-hash cache still works.
+try:
+    import sqlite3
+    import sqlite_vec
+    from fastembed import TextEmbedding
+    _SEMANTIC_AVAILABLE = True
+except ImportError:
+    _SEMANTIC_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Where synthesized clips are stored; override with TTS_CACHE_DIR.
+# Clips are kept as raw MP3 bytes (not base64) to save a third of the disk.
+CACHE_DIR = os.environ.get("TTS_CACHE_DIR", os.path.join(os.path.dirname(__file__), "tts_cache"))
+
+
+def cache_key(text: str, voice_id: str, model_id: str, voice_settings: dict) -> str:
+    """
+    Content address for one synthesis request: any input that changes the
+    audio (text, voice, model, settings) is part of the hash.
+    """
+    payload = orjson.dumps(
+        {"t": text, "v": voice_id, "m": model_id, "s": voice_settings},
+        option=orjson.OPT_SORT_KEYS,
+    )
+    # blake2b, not sha256: the key only addresses cache files, so the
+    # cheaper non-crypto-grade hash is plenty (and matches the selection
+    # cache and singleflight keys)
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+def cache_path(key: str) -> str:
+    return os.path.join(CACHE_DIR, f"{key}.mp3")
+
+
+def get(key: str) -> bytes | None:
+    """
+    Returns the cached MP3 bytes for a key, or None on a miss.
+    """
+    try:
+        with open(cache_path(key), "rb") as file:
+            audio = file.read()
+    except FileNotFoundError:
+        return None
+    logger.debug("TTS cache hit for %s", key[:12])
+    return audio
+
+
+def put(key: str, audio: bytes):
+    """
+    Stores MP3 bytes under a key, atomically so a crash mid-write can't
+    leave a truncated clip that would be served forever. Each writer gets
+    its own uniquely named temp file (as in json_store.save_json), so
+    concurrent requests or workers storing the same key can't truncate
+    each other's temp file mid-replace.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(audio)
+        os.replace(tmp, cache_path(key))
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    logger.debug("TTS cache stored %s (%d bytes)", key[:12], len(audio))
+
+
+# --- Semantic tier -----------------------------------------------------
+# Exact hashing misses near-duplicates ("Hello!" vs "Hello."), which agent
+# prompts produce constantly. This tier embeds the text and serves the
+# closest cached clip for the same voice when it's within a tight cosine
+# distance. Lookups never mix voices.
+
+_SEMANTIC_MAX_DISTANCE = 0.05
+_SEMANTIC_TTL = 24 * 3600  # seconds
+
+_semantic_lock = threading.Lock()
+_embedder = None
+_db = None
+
+
+def _semantic_init() -> bool:
+    """Lazily loads the embedder and opens the sqlite index; returns False
+    when the optional dependencies aren't installed."""
+    global _embedder, _db
+    if not _SEMANTIC_AVAILABLE:
+        return False
+    if _db is None:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        _embedder = TextEmbedding("BAAI/bge-small-en-v1.5")
+        _db = sqlite3.connect(os.path.join(CACHE_DIR, "semantic.db"), check_same_thread=False)
+        _db.enable_load_extension(True)
+        sqlite_vec.load(_db)
+        _db.enable_load_extension(False)
+        _db.execute(
+            "CREATE TABLE IF NOT EXISTS tts_vec ("
+            "voice_id TEXT NOT NULL, cache_key TEXT NOT NULL, "
+            "embedding BLOB NOT NULL, created_at REAL NOT NULL)"
+        )
+    return True
+
+
+def _embed(text: str) -> bytes:
+    vector = next(iter(_embedder.embed([text])))
+    return sqlite_vec.serialize_float32([float(x) for x in vector])
+
+
+def semantic_get(text: str, voice_id: str) -> bytes | None:
+    """
+    Returns cached audio for the nearest-by-embedding text in the same
+    voice, or None if nothing is close enough (or the tier is disabled).
+    """
+    with _semantic_lock:
+        if not _semantic_init():
+            return None
+        row = _db.execute(
+            "SELECT cache_key, vec_distance_cosine(embedding, ?) AS distance "
+            "FROM tts_vec WHERE voice_id = ? AND created_at > ? "
+            "ORDER BY distance LIMIT 1",
+            (_embed(text), voice_id, time.time() - _SEMANTIC_TTL),
+        ).fetchone()
+    if row is None or row[1] >= _SEMANTIC_MAX_DISTANCE:
+        return None
+    logger.debug("TTS semantic cache hit (distance %.4f)", row[1])
+    return get(row[0])
+
+
+def semantic_put(text: str, voice_id: str, key: str):
+    """
+    Indexes a freshly synthesized clip for semantic lookup, evicting
+    entries past the TTL while it's at it.
+    """
+    with _semantic_lock:
+        if not _semantic_init():
+            return
+        now = time.time()
+        _db.execute("DELETE FROM tts_vec WHERE created_at < ?", (now - _SEMANTIC_TTL,))
+        _db.execute(
+            "INSERT INTO tts_vec (voice_id, cache_key, embedding, created_at) VALUES (?, ?, ?, ?)",
+            (voice_id, key, _embed(text), now),
+        )
+        _db.commit()
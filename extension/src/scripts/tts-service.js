@@ -59,24 +59,25 @@ class TTSService {
         return;
       }
 
-      const result = await response.json();
-      
-      if (result.status !== 'success' || !result.audio) {
-        console.error('[TTS] Failed: No audio returned', result);
-        return;
-      }
+      // Server sends raw MP3 bytes (no base64-in-JSON inflation)
+      const audioBuffer = await response.arrayBuffer();
 
-      // Validate base64 string
-      if (typeof result.audio !== 'string' || result.audio.length === 0) {
-        console.error('[TTS] Invalid audio data received');
+      if (!audioBuffer || audioBuffer.byteLength === 0) {
+        console.error('[TTS] Failed: No audio returned');
         return;
       }
 
-      console.log('[TTS] Received audio data, size:', result.audio.length, 'chars');
+      console.log('[TTS] Received audio data, size:', audioBuffer.byteLength, 'bytes');
 
       // Use data URL instead of blob URL to bypass CSP restrictions
       // Data URLs are inline and not blocked by Content Security Policy
-      const audioDataUrl = `data:audio/mpeg;base64,${result.audio}`;
+      const audioBlob = new Blob([audioBuffer], { type: 'audio/mpeg' });
+      const audioDataUrl = await new Promise((resolve, reject) => {
+        const reader = new FileReader();
+        reader.onload = () => resolve(reader.result);
+        reader.onerror = reject;
+        reader.readAsDataURL(audioBlob);
+      });
       console.log('[TTS] Created data URL, length:', audioDataUrl.length);
       
       this.currentAudio = new Audio(audioDataUrl);